@@ -7,13 +7,18 @@ Usage:
     ./migrate-docs.py              # Execute migration
 """
 
+import argparse
+import io
 import os
 import re
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import date, datetime
+from functools import cache
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 WORKSPACE = Path("/home/ubuntu/workspaces/flovyn")
 TARGET_DIR = WORKSPACE / "dev" / "docs"
@@ -33,46 +38,111 @@ SOURCES = [
 TARGET_DIRS = ["design", "plans", "research", "bugs", "guides", "architecture", "archive"]
 
 # File extensions for code references
-CODE_EXTENSIONS = {".rs", ".ts", ".tsx", ".py", ".kt", ".toml", ".sql", ".md", ".sh", ".json", ".yaml", ".yml"}
+CODE_EXTENSIONS = frozenset({".rs", ".ts", ".tsx", ".py", ".kt", ".toml", ".sql", ".md", ".sh", ".json", ".yaml", ".yml"})
 
+# Repo prefixes for code references that are already normalized
+_REPO_PREFIXES = ("flovyn-server/", "flovyn-app/", "sdk-rust/", "sdk-python/", "sdk-kotlin/", "dev/")
+_WORKSPACE_PREFIX = str(WORKSPACE).rstrip("/") + "/"
 
-@dataclass
+# Inline code paths in backticks: `path/to/file.rs`; shared by the body
+# scanner and the pass over markdown link text
+_CODE_REF_PATTERN = r'`(?P<code_ref>[^`]+\.[a-z]{1,4}(?::\d+)?)`'
+
+
+# Patterns used on every file, compiled on first use so --help and argument
+# errors don't pay for them
+@cache
+def _re_date_prefix() -> re.Pattern[str]:
+    return re.compile(r"^\d{8}_")
+
+
+@cache
+def _re_seq() -> re.Pattern[str]:
+    return re.compile(r"_\d{3}-")
+
+
+@cache
+def _re_code_ref() -> re.Pattern[str]:
+    return re.compile(_CODE_REF_PATTERN)
+
+
+@cache
+def _re_links() -> re.Pattern[str]:
+    # Single-pass scanner for everything normalize_links_in_content rewrites:
+    #   md   - markdown links: [text](path)
+    #   code - inline code paths in backticks: `path/to/file.rs`
+    #   meta - Design/Plan references: **Design:** [link] or **Design:** path
+    # meta still runs to the end of the line, but does not match when the label
+    # is directly followed by a markdown link, and stops early at a bracket or
+    # backtick so links and code refs later on the line are still matched.
+    # Trailing whitespace is left out of the match and kept.
+    return re.compile(
+        r'(?P<md>\[(?P<md_text>[^\]]*)\]\((?P<md_path>[^)]+)\))'
+        rf'|(?P<code>{_CODE_REF_PATTERN})'
+        r'|(?P<meta>\*\*(?P<meta_label>Design|Plan|Bug):\*\*\s*(?!\[[^\]]*\]\()\[?(?P<meta_path>[^\[\]`\n]*[^\s\[\]`])\]?)'
+    )
+
+
+@cache
+def _re_dev_docs() -> re.Pattern[str]:
+    return re.compile(r"[^/]+/\.dev/docs/")
+
+
+@cache
+def _re_leading_dotdot() -> re.Pattern[str]:
+    return re.compile(r"^(\.\./)+")
+
+
+@dataclass(slots=True)
 class FileMapping:
-    old_path: Path
-    new_path: Path
+    old_path: str
+    new_path: str
     old_filename: str
     new_filename: str
     source_repo: str
 
 
-def get_git_date(file_path: Path) -> str:
-    """Get file creation date from git history."""
+def build_git_date_index(repo_root: Path) -> Dict[str, str]:
+    """Get creation dates for every markdown file in a repo from one git log walk."""
+    dates: Dict[str, str] = {}
+    root = str(repo_root)
     try:
-        # Try to get the date when file was added
+        # Walk history oldest-first, following renames like `git log --follow`
+        # (-M so it doesn't depend on diff.renames).
+        # With -z every header, status and path is a NUL-terminated field and
+        # paths are never quoted; \x01 marks the commit date fields.
         result = subprocess.run(
-            ["git", "-C", str(file_path.parent), "log", "--follow", "--format=%cs", "--diff-filter=A", "--", str(file_path)],
-            capture_output=True, text=True, timeout=10
+            ["git", "-C", str(repo_root), "log", "--reverse", "-z", "-M",
+             "--diff-filter=AR", "--name-status", "--format=%x01%cs", "--", "*.md"],
+            capture_output=True, text=True, encoding="utf-8", errors="surrogateescape", timeout=60
         )
-        dates = result.stdout.strip().split('\n')
-        if dates and dates[-1]:
-            return dates[-1].replace("-", "")
-
-        # Fallback to last modified date
-        result = subprocess.run(
-            ["git", "-C", str(file_path.parent), "log", "-1", "--format=%cs", "--", str(file_path)],
-            capture_output=True, text=True, timeout=10
-        )
-        if result.stdout.strip():
-            return result.stdout.strip().replace("-", "")
-    except Exception:
-        pass
-
-    # Fallback to today
-    from datetime import date
-    return date.today().strftime("%Y%m%d")
-
-
-def normalize_filename(filename: str, source_file: Path) -> str:
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Warning: git log failed in {repo_root}: {e}; using today's date", file=sys.stderr)
+        return dates
+
+    if result.returncode != 0:
+        print(f"Warning: git log failed in {repo_root}: {result.stderr.strip()}; using today's date",
+              file=sys.stderr)
+        return dates
+
+    commit_date = ""
+    fields = iter(result.stdout.split("\0"))
+    for field in fields:
+        # Newlines only separate a commit header from its status fields
+        field = field.lstrip("\n")
+        if field.startswith("\x01"):
+            commit_date = field[1:].replace("-", "")
+        elif field == "A":
+            dates.setdefault(os.path.join(root, next(fields)), commit_date)
+        elif field.startswith("R"):
+            old_path = os.path.join(root, next(fields))
+            new_path = os.path.join(root, next(fields))
+            dates[new_path] = dates.pop(old_path, commit_date)
+
+    return dates
+
+
+def normalize_filename(filename: str, source_file: str, git_dates: Dict[str, str]) -> str:
     """Normalize filename to YYYYMMDD_snake_case.md format."""
     result = filename
 
@@ -81,13 +151,13 @@ def normalize_filename(filename: str, source_file: Path) -> str:
         result = result[:-3]
 
     # Check if already has YYYYMMDD_ prefix
-    if not re.match(r"^\d{8}_", result):
+    if not _re_date_prefix().match(result):
         # Add date prefix
-        date = get_git_date(source_file)
-        result = f"{date}_{result}"
+        file_date = git_dates.get(source_file) or date.today().strftime("%Y%m%d")
+        result = f"{file_date}_{result}"
 
     # Remove sequence numbers like _001- or _002-
-    result = re.sub(r"_\d{3}-", "_", result)
+    result = _re_seq().sub("_", result)
 
     # Convert kebab-case to snake_case
     result = result.replace("-", "_")
@@ -95,51 +165,71 @@ def normalize_filename(filename: str, source_file: Path) -> str:
     return f"{result}.md"
 
 
+def walk_md(root: str):
+    """Yield paths of all markdown files under root without following symlinks."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".md"):
+                    yield entry.path
+
+
 def build_filename_mapping(dry_run: bool) -> Tuple[List[FileMapping], Dict[str, str]]:
     """Build mapping of old paths to new paths."""
     mappings: List[FileMapping] = []
     filename_map: Dict[str, str] = {}  # old_filename -> new_filename
+    taken: Set[str] = set()  # new_path of every mapping so far
+    target_base = str(TARGET_DIR)
+
+    # One git log per repo instead of one per file
+    git_dates: Dict[str, str] = {}
+    for source_repo in dict.fromkeys(repo for _, repo in SOURCES):
+        repo_root = WORKSPACE / source_repo
+        if repo_root.exists():
+            git_dates.update(build_git_date_index(repo_root))
 
     for source_dir, source_repo in SOURCES:
         if not source_dir.exists():
             continue
 
-        for source_file in sorted(source_dir.rglob("*.md")):
-            relative_path = source_file.relative_to(source_dir)
-            parts = relative_path.parts
+        # Sort by path components, matching the ordering of sorted Path objects
+        source_root = str(source_dir)
+        for source_file in sorted(walk_md(source_root), key=lambda p: p.split(os.sep)):
+            parts = os.path.relpath(source_file, source_root).split(os.sep)
 
             # Get directory type (bugs, design, plans, research, guides)
             dir_type = parts[0]
 
             # Get filename and normalize
-            old_filename = source_file.name
-            new_filename = normalize_filename(old_filename, source_file)
+            old_filename = parts[-1]
+            new_filename = normalize_filename(old_filename, source_file, git_dates)
 
             # Handle subdirectories
             if len(parts) > 2:
-                subdir = parts[1]
-                target_path = TARGET_DIR / dir_type / subdir / new_filename
+                target_dir = f"{target_base}/{dir_type}/{parts[1]}"
             else:
-                target_path = TARGET_DIR / dir_type / new_filename
-
-            # Check for conflicts
-            if target_path.exists() or any(m.new_path == target_path for m in mappings):
-                # Add repo suffix to resolve
-                base = new_filename[:-3]  # Remove .md
-                new_filename = f"{base}_{source_repo}.md"
-                if len(parts) > 2:
-                    target_path = TARGET_DIR / dir_type / subdir / new_filename
-                else:
-                    target_path = TARGET_DIR / dir_type / new_filename
-
-            mapping = FileMapping(
-                old_path=source_file,
-                new_path=target_path,
-                old_filename=old_filename,
-                new_filename=new_filename,
-                source_repo=source_repo
-            )
+                target_dir = f"{target_base}/{dir_type}"
+            target_path = f"{target_dir}/{new_filename}"
+
+            # Check for conflicts, re-checking every candidate so two files
+            # never map to the same target
+            if target_path in taken or os.path.exists(target_path):
+                # Add repo suffix to resolve, then a counter if that is taken too
+                base = f"{new_filename[:-3]}_{source_repo}"  # Remove .md
+                new_filename = f"{base}.md"
+                target_path = f"{target_dir}/{new_filename}"
+                counter = 2
+                while target_path in taken or os.path.exists(target_path):
+                    new_filename = f"{base}_{counter}.md"
+                    target_path = f"{target_dir}/{new_filename}"
+                    counter += 1
+
+            mapping = FileMapping(source_file, target_path, old_filename, new_filename, source_repo)
             mappings.append(mapping)
+            taken.add(target_path)
             filename_map[old_filename] = new_filename
 
     return mappings, filename_map
@@ -151,38 +241,43 @@ def normalize_doc_link(link: str, filename_map: Dict[str, str], source_repo: str
     filename = os.path.basename(link)
 
     if filename in filename_map:
-        # Replace filename with new name
+        # Replace filename with new name; basename is always the link's tail
         new_filename = filename_map[filename]
-        return link.replace(filename, new_filename)
+        return link[:len(link) - len(filename)] + new_filename
 
     return link
 
 
+def _ext(path: str) -> str:
+    """Return the extension of a posix path, like os.path.splitext(path)[1] without the tuple."""
+    dot = path.rfind(".")
+    # A dot leading the basename (e.g. .env) does not start an extension
+    return path[dot:] if dot > path.rfind("/") + 1 else ""
+
+
 def normalize_code_reference(ref: str, source_repo: str) -> str:
     """Normalize a code reference to {repo}/{path} format."""
     # Already has repo prefix
-    for repo in ["flovyn-server", "flovyn-app", "sdk-rust", "sdk-python", "sdk-kotlin", "dev"]:
-        if ref.startswith(f"{repo}/"):
-            # Just convert kebab to snake if needed in the path part after repo
-            return ref
+    if ref.startswith(_REPO_PREFIXES):
+        return ref
 
     # Absolute path - strip workspace prefix
-    workspace_str = str(WORKSPACE)
-    if ref.startswith(workspace_str):
-        ref = ref[len(workspace_str):].lstrip("/")
-        return ref
+    # removeprefix hands back the same object when there is no match
+    stripped = ref.removeprefix(_WORKSPACE_PREFIX)
+    if stripped is not ref:
+        return stripped.lstrip("/")
 
     # Relative path like ../../src/foo.rs or ../src/foo.rs
     if ref.startswith(".."):
         # Try to resolve based on source repo
         # Remove leading ../
-        clean_ref = re.sub(r"^(\.\./)+", "", ref)
+        clean_ref = _re_leading_dotdot().sub("", ref)
         return f"{source_repo}/{clean_ref}"
 
     # Path without repo prefix like src/foo.rs
     if "/" in ref and not ref.startswith("."):
         # Check if it looks like a code path
-        ext = os.path.splitext(ref)[1]
+        ext = _ext(ref)
         if ext in CODE_EXTENSIONS:
             return f"{source_repo}/{ref}"
 
@@ -193,82 +288,121 @@ def normalize_links_in_content(content: str, filename_map: Dict[str, str], sourc
     """Normalize all links in file content. Returns (new_content, warnings)."""
     warnings = []
     new_content = content
+    re_code_ref = _re_code_ref()
+    re_dev_docs = _re_dev_docs()
 
-    # Pattern for markdown links: [text](path)
-    md_link_pattern = r'\[([^\]]*)\]\(([^)]+)\)'
+    def replace_code_ref(match):
+        ref = match.group("code_ref")
+        ext = _ext(ref.split(":")[0])  # Handle :line_number
+        if ext in CODE_EXTENSIONS:
+            new_ref = normalize_code_reference(ref, source_repo)
+            return f"`{new_ref}`"
+        return match.group(0)
 
     def replace_md_link(match):
-        text = match.group(1)
-        path = match.group(2)
+        text = match.group("md_text")
+        path = match.group("md_path")
+
+        # Code refs in the link text are not seen by the scanner
+        if "`" in text:
+            text = re_code_ref.sub(replace_code_ref, text)
 
         # Skip URLs
         if path.startswith(("http://", "https://", "#")):
-            return match.group(0)
+            return f"[{text}]({path})"
 
         # Check if it's a doc link
         if path.endswith(".md") or "/.dev/docs/" in path:
             new_path = normalize_doc_link(path, filename_map, source_repo)
             # Also update .dev/docs paths
-            new_path = re.sub(r"[^/]+/\.dev/docs/", "dev/docs/", new_path)
+            if "/.dev/docs/" in new_path:
+                new_path = re_dev_docs.sub("dev/docs/", new_path, count=1)
             return f"[{text}]({new_path})"
 
         # Check if it's a code reference
-        ext = os.path.splitext(path)[1]
+        ext = _ext(path)
         if ext in CODE_EXTENSIONS:
             new_path = normalize_code_reference(path, source_repo)
             return f"[{text}]({new_path})"
 
-        return match.group(0)
-
-    new_content = re.sub(md_link_pattern, replace_md_link, new_content)
-
-    # Pattern for inline code paths in backticks: `path/to/file.rs`
-    code_ref_pattern = r'`([^`]+\.[a-z]{1,4}(?::\d+)?)`'
-
-    def replace_code_ref(match):
-        ref = match.group(1)
-        ext = os.path.splitext(ref.split(":")[0])[1]  # Handle :line_number
-        if ext in CODE_EXTENSIONS:
-            new_ref = normalize_code_reference(ref, source_repo)
-            return f"`{new_ref}`"
-        return match.group(0)
-
-    new_content = re.sub(code_ref_pattern, replace_code_ref, new_content)
-
-    # Pattern for Design/Plan references: **Design:** [link] or **Design:** path
-    meta_pattern = r'\*\*(Design|Plan|Bug):\*\*\s*\[?([^\]\n]+)\]?'
+        return f"[{text}]({path})"
 
     def replace_meta(match):
-        label = match.group(1)
-        path = match.group(2).strip()
+        label = match.group("meta_label")
+        path = match.group("meta_path").strip()
         if path.endswith(".md"):
             new_path = normalize_doc_link(path, filename_map, source_repo)
-            new_path = re.sub(r"[^/]+/\.dev/docs/", "dev/docs/", new_path)
+            if "/.dev/docs/" in new_path:
+                new_path = re_dev_docs.sub("dev/docs/", new_path, count=1)
             return f"**{label}:** {new_path}"
         return match.group(0)
 
-    new_content = re.sub(meta_pattern, replace_meta, new_content)
+    def replace_link(match):
+        kind = match.lastgroup
+        if kind == "md":
+            return replace_md_link(match)
+        if kind == "code":
+            return replace_code_ref(match)
+        return replace_meta(match)
+
+    # Files without any candidate come back as the original string object
+    if "](" in new_content or "`" in new_content or "**" in new_content:
+        new_content = _re_links().sub(replace_link, new_content)
 
     return new_content, warnings
 
 
+def read_bytes_fast(path: str) -> bytes:
+    """Read a whole file with a single fstat-sized read."""
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        # Regular files come back in one read; keep going on a short read
+        while len(data) < size:
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+    finally:
+        os.close(fd)
+
+
+def write_bytes_fast(path: str, data: bytes):
+    """Write a whole file without going through the buffered io layer."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
 def migrate_file(mapping: FileMapping, filename_map: Dict[str, str], dry_run: bool) -> List[str]:
     """Migrate a single file. Returns warnings."""
     warnings = []
 
-    # Read content
-    content = mapping.old_path.read_text()
+    # Read raw bytes; only decode when something could need rewriting
+    raw = read_bytes_fast(mapping.old_path)
+    new_content: Optional[str] = None
+    if b"](" in raw or b"`" in raw or b"**" in raw or b"\r" in raw:
+        text = raw.decode("utf-8")
+        # Translate line endings like read_text() did, so output is always LF
+        content = text.replace("\r\n", "\n").replace("\r", "\n") if "\r" in text else text
 
-    # Normalize links
-    new_content, link_warnings = normalize_links_in_content(content, filename_map, mapping.source_repo)
-    warnings.extend(link_warnings)
+        # Normalize links
+        new_content, link_warnings = normalize_links_in_content(content, filename_map, mapping.source_repo)
+        warnings.extend(link_warnings)
+        if new_content == text:
+            new_content = None
 
     if not dry_run:
-        # Create parent directory
-        mapping.new_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Write file
-        mapping.new_path.write_text(new_content)
+        # Write file (parent directories are created up front), reusing the
+        # bytes already read when nothing changed
+        data = raw if new_content is None else new_content.encode("utf-8")
+        write_bytes_fast(mapping.new_path, data)
 
     return warnings
 
@@ -278,45 +412,67 @@ def write_mapping_file(mappings: List[FileMapping], dry_run: bool):
     if dry_run:
         return
 
-    with open(MAPPING_FILE, "w") as f:
-        f.write("# Doc Migration Mapping\n")
-        f.write(f"# Generated: {subprocess.run(['date'], capture_output=True, text=True).stdout.strip()}\n")
-        f.write("# Format: old_path -> new_path\n\n")
+    generated = datetime.now().isoformat(timespec="seconds")
+    with open(MAPPING_FILE, "w", buffering=1 << 20) as f:
+        f.write(
+            "# Doc Migration Mapping\n"
+            f"# Generated: {generated}\n"
+            "# Format: old_path -> new_path\n\n"
+            + "".join(f"{m.old_path} -> {m.new_path}\n" for m in mappings)
+        )
+
 
-        for m in mappings:
-            f.write(f"{m.old_path} -> {m.new_path}\n")
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Migrate docs from scattered .dev/docs/ to centralized dev/docs/"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Preview changes without executing")
+    return parser.parse_args()
 
 
 def main():
-    dry_run = "--dry-run" in sys.argv
+    dry_run = parse_args().dry_run
+
+    # Block-buffer stdout even on a terminal; sections flush explicitly
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
 
     if dry_run:
         print("=== DRY RUN MODE ===\n")
 
     print("=== Doc Migration Script ===\n")
 
-    # Create target directories
-    print("Creating target directories...")
-    for dir_name in TARGET_DIRS:
-        target = TARGET_DIR / dir_name
-        print(f"  {target}")
-        if not dry_run:
-            target.mkdir(parents=True, exist_ok=True)
-    print()
-
     # Build mapping
     print("Building file mapping...")
+    sys.stdout.flush()
     mappings, filename_map = build_filename_mapping(dry_run)
     print(f"  Found {len(mappings)} files to migrate\n")
 
-    # Migrate files
-    all_warnings = []
-    for mapping in mappings:
-        print(f"  {mapping.old_path}")
-        print(f"    -> {mapping.new_path}")
+    sys.stdout.write("".join(f"  {m.old_path}\n    -> {m.new_path}\n" for m in mappings))
 
-        warnings = migrate_file(mapping, filename_map, dry_run)
-        all_warnings.extend(warnings)
+    # Files are written concurrently, so two mappings must never share a target
+    if len({m.new_path for m in mappings}) != len(mappings):
+        sys.stdout.flush()
+        sys.exit("Error: multiple files map to the same target path")
+
+    # Create target directories and every mapped subdirectory once before
+    # concurrent writes; sorted so parents come first and each makedirs is a
+    # single mkdir
+    print("\nCreating target directories...")
+    for dir_name in TARGET_DIRS:
+        print(f"  {TARGET_DIR / dir_name}")
+    sys.stdout.flush()
+    if not dry_run:
+        target_dirs = {str(TARGET_DIR / dir_name) for dir_name in TARGET_DIRS}
+        target_dirs.update(os.path.dirname(m.new_path) for m in mappings)
+        for target in sorted(target_dirs):
+            os.makedirs(target, exist_ok=True)
+
+    # Migrate files; the work is I/O bound so threads overlap the syscalls
+    all_warnings = []
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for warnings in executor.map(lambda m: migrate_file(m, filename_map, dry_run), mappings):
+            all_warnings.extend(warnings)
 
     # Write mapping file
     write_mapping_file(mappings, dry_run)
@@ -333,8 +489,7 @@ def main():
 
     if all_warnings:
         print(f"\nWarnings ({len(all_warnings)}):")
-        for w in all_warnings:
-            print(f"  - {w}")
+        sys.stdout.write("".join(f"  - {w}\n" for w in all_warnings))
 
 
 if __name__ == "__main__":